@@ -73,7 +73,21 @@ iter_print_level = 1000
 # 1: Without any restrictions
 # 2: City B quarantines people who shows symptoms
 # 3: City B quarantines all travelers from City A
+# 4: City B quarantines people who shows symptoms and their recent close contacts
 scenario_code = 3
 
+# Contact tracing (Scenario 4)
+# Maximal number of recent close contacts kept for each person.
+contact_buffer_capacity = 16
+# Number of iterations before the detection that the close contacts are traced.
+contact_tracing_period = 360
+
 # whether print detail info.
 verbose = False
+
+# Whether record the trajectory (location and status of everyone) into a memory-mapped file (check trajectory.py).
+record_trajectory = False
+# Record the trajectory every N iterations.
+trajectory_stride = 10
+# Path of the trajectory file ({} is replaced by the round number).
+trajectory_path = 'trajectory_round{}.npy'
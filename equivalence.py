@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+equivalence.py: check whether an alternative simulation engine is statistically equivalent to the reference one.
+Course: IS 597PRO Fall 2020
+Author: Erick Li
+
+A faster engine will not reproduce the random draws of the reference implementation (main.one_round), so the two
+engines are compared by distribution instead. Both engines are run over many seeds for every scenario code. For each
+of the three local rates (real, detected, virus active) and for the final infection counts, the per-seed results are
+compared with a two-sample Kolmogorov-Smirnov test and a tolerance band around the mean.
+
+An engine is a function engine(seed, scenario_code) that runs one round and returns a tuple of
+  - a pandas dataframe with the columns in main.COLNAMES (one row per train departure), and
+  - a dictionary of the final infection counts (same keys as reference_engine).
+"""
+
+import math
+import random
+import sys
+import numpy as np
+import pandas as pd
+import main
+
+# The rate trajectories being compared.
+RATE_COLUMNS = main.COLNAMES[1:]
+# The final infection counts being compared.
+COUNT_KEYS = ['final_infected', 'final_local_infected']
+
+
+def reference_engine(seed, scenario_code):
+    """
+    Run one round of the reference simulation (main.one_round).
+    :param seed: the random seed.
+    :param scenario_code: the scenario code (check configfile.py)
+    :return: the dataframe of the local rates, and a dictionary of the final infection counts. final_infected: number
+    of infected people in both cities; final_local_infected: number of infected City B citizens.
+    """
+    random.seed(seed)
+    dta, city0, city1 = main.one_round(0, pd.DataFrame(columns=main.COLNAMES), scenario_code, return_cities=True)
+    everyone = city0.people_list + city1.people_list
+    counts = {
+        'final_infected': sum(p.infected for p in everyone),
+        'final_local_infected': sum((p.infected and p.original_city == city1.cid) for p in everyone),
+    }
+    return dta, counts
+
+
+def ks_2samp(sample1, sample2):
+    """
+    Two-sample Kolmogorov-Smirnov test (with the asymptotic p-value).
+    :param sample1: the first sample.
+    :param sample2: the second sample.
+    :return: the KS statistic and the p-value.
+    >>> ks_2samp([1, 2, 3, 4], [1, 2, 3, 4])
+    (0.0, 1.0)
+    >>> d, p = ks_2samp(list(range(20)), list(range(100, 120)))
+    >>> d, p < 0.001
+    (1.0, True)
+    >>> ks_2samp([], [1])
+    Traceback (most recent call last):
+    ...
+    ValueError: both samples must be non-empty
+    """
+    sample1 = np.sort(np.asarray(sample1, dtype=float))
+    sample2 = np.sort(np.asarray(sample2, dtype=float))
+    n1, n2 = len(sample1), len(sample2)
+    if n1 == 0 or n2 == 0:
+        raise ValueError('both samples must be non-empty')
+    pooled = np.concatenate([sample1, sample2])
+    cdf1 = np.searchsorted(sample1, pooled, side='right') / n1
+    cdf2 = np.searchsorted(sample2, pooled, side='right') / n2
+    d = float(np.max(np.abs(cdf1 - cdf2)))
+
+    # Asymptotic Kolmogorov distribution with the small-sample correction of Stephens (1970).
+    en = math.sqrt(n1 * n2 / (n1 + n2))
+    lam = (en + 0.12 + 0.11 / en) * d
+    if lam < 1e-3:
+        return d, 1.0
+    p = 2 * sum((-1) ** (k - 1) * math.exp(-2 * k ** 2 * lam ** 2) for k in range(1, 101))
+    return d, float(min(max(p, 0.0), 1.0))
+
+
+def within_band(reference, candidate, abs_tol, z):
+    """
+    Check whether the mean of the candidate is within the tolerance band around the mean of the reference at every
+    sample point. The half width of the band is abs_tol + z * (standard error of the difference of the means).
+    :param reference: 2-D array (seeds x sample points) of the reference results.
+    :param candidate: 2-D array (seeds x sample points) of the candidate results.
+    :param abs_tol: the absolute tolerance.
+    :param z: number of standard errors allowed.
+    :return: the largest deviation divided by the half width of the band (the check passes if it is at most 1).
+    >>> within_band(np.array([[0.1, 0.2], [0.3, 0.4]]), np.array([[0.1, 0.2], [0.3, 0.4]]), 0.01, 3)
+    0.0
+    >>> within_band(np.array([[0.0], [0.0]]), np.array([[0.5], [0.5]]), 0.1, 3)
+    5.0
+    """
+    if abs_tol <= 0:
+        raise ValueError('abs_tol must be greater than 0')
+    reference = np.asarray(reference, dtype=float)
+    candidate = np.asarray(candidate, dtype=float)
+    diff = np.abs(reference.mean(axis=0) - candidate.mean(axis=0))
+    se = np.sqrt(reference.var(axis=0, ddof=1) / len(reference) + candidate.var(axis=0, ddof=1) / len(candidate)) \
+        if len(reference) > 1 and len(candidate) > 1 else np.zeros_like(diff)
+    return float(np.max(diff / (abs_tol + z * se)))
+
+
+def collect(engine, seeds, scenario_code):
+    """
+    Run the engine over the seeds.
+    :param engine: the simulation engine.
+    :param seeds: list of random seeds.
+    :param scenario_code: the scenario code (check configfile.py)
+    :return: the sample iterations, a dictionary of 2-D arrays (seeds x sample points) of the rates, and a dictionary
+    of 1-D arrays (seeds) of the final infection counts.
+    """
+    iters = None
+    rates = {col: [] for col in RATE_COLUMNS}
+    counts = {key: [] for key in COUNT_KEYS}
+    for seed in seeds:
+        dta, final_counts = engine(seed, scenario_code)
+        if iters is None:
+            iters = dta['iter'].to_numpy(dtype=float)
+        for col in RATE_COLUMNS:
+            rates[col].append(dta[col].to_numpy(dtype=float))
+        for key in COUNT_KEYS:
+            counts[key].append(final_counts[key])
+    return iters, {col: np.array(v) for col, v in rates.items()}, {key: np.array(v) for key, v in counts.items()}
+
+
+class EquivalenceReport:
+    def __init__(self, alpha):
+        """
+        The pass/fail report of the comparison.
+        :param alpha: the overall significance level (Bonferroni-corrected over all the KS tests).
+        """
+        self.alpha = alpha
+        self.checks = []  # list of (scenario code, metric, test, value, threshold, passed)
+
+    def __repr__(self):
+        return '<EquivalenceReport {} ({} checks)>'.format('PASS' if self.passed else 'FAIL', len(self.checks))
+
+    def __str__(self):
+        lines = ['{:<9} {:<38} {:<10} {:>10} {:>10}  {}'.format('scenario', 'metric', 'test', 'value', 'threshold',
+                                                                'result')]
+        for scenario_code, metric, test, value, threshold, passed in self.checks:
+            lines.append('{:<9} {:<38} {:<10} {:>10.4g} {:>10.4g}  {}'.format(
+                scenario_code, metric, test, value, threshold, 'pass' if passed else 'FAIL'))
+        lines.append('Overall: ' + ('PASS' if self.passed else 'FAIL'))
+        return '\n'.join(lines)
+
+    @property
+    def passed(self):
+        """
+        Whether every check passed.
+        :return: boolean value showing if the candidate engine is equivalent to the reference engine.
+        """
+        return all(check[-1] for check in self.checks)
+
+    def add_check(self, scenario_code, metric, test, value, threshold, passed):
+        """
+        Add a check to the report.
+        :param scenario_code: the scenario code.
+        :param metric: the metric being compared.
+        :param test: name of the test ('ks' for p-values, 'band' for the tolerance band, 'iters' for sample points).
+        :param value: the test result (p-value or the deviation ratio).
+        :param threshold: the threshold the value is compared to.
+        :param passed: whether the check passed.
+        :return:
+        """
+        self.checks.append((scenario_code, metric, test, value, threshold, bool(passed)))
+
+
+def compare_engines(candidate, reference=reference_engine, seeds=range(20), scenario_codes=(1, 2, 3, 4), alpha=0.01,
+                    abs_tol=0.02, z=3.0, candidate_seed_offset=1000000):
+    """
+    Run the reference and the candidate engines over the seeds and the scenario codes, and compare the results.
+    For every scenario and every metric (rate trajectories and final infection counts):
+      - 'ks': two-sample KS test on the per-seed summaries (the mean over time and the final value of the rates, or
+        the counts). It passes if the p-value is at least alpha divided by the number of KS tests.
+      - 'band': the mean of the candidate stays within the tolerance band of the reference (check within_band). The
+        tolerance of each count is abs_tol times the population the count covers (both cities for final_infected,
+        City B for final_local_infected).
+    :param candidate: the candidate engine.
+    :param reference: (optional, default: reference_engine) the reference engine.
+    :param seeds: (optional, default: range(20)) the random seeds.
+    :param scenario_codes: (optional, default: (1, 2, 3, 4)) the scenario codes.
+    :param alpha: (optional, default: 0.01) the overall significance level.
+    :param abs_tol: (optional, default: 0.02) the absolute tolerance of the rates.
+    :param z: (optional, default: 3.0) number of standard errors allowed in the tolerance band.
+    :param candidate_seed_offset: (optional, default: 1000000) added to the seeds of the candidate so that the two
+    samples are independent.
+    :return: an EquivalenceReport.
+    >>> def make_engine(shift):
+    ...     def engine(seed, scenario_code):
+    ...         rng = np.random.default_rng(seed)
+    ...         dta = pd.DataFrame({'iter': [0, 200, 400]})
+    ...         for col in RATE_COLUMNS:
+    ...             dta[col] = np.clip(rng.normal(0.3 + shift, 0.05, size=3), 0, 1)
+    ...         counts = {'final_infected': rng.binomial(200, 0.4 + shift),
+    ...                   'final_local_infected': rng.binomial(100, 0.3 + shift)}
+    ...         return dta, counts
+    ...     return engine
+    >>> compare_engines(make_engine(0), make_engine(0), seeds=range(30), scenario_codes=(1,))
+    <EquivalenceReport PASS (14 checks)>
+    >>> report = compare_engines(make_engine(0.2), make_engine(0), seeds=range(30), scenario_codes=(1,))
+    >>> report
+    <EquivalenceReport FAIL (14 checks)>
+    >>> [(metric, test) for _, metric, test, _, _, passed in report.checks if not passed][:2]
+    [('local_real_infection_rate (mean)', 'ks'), ('local_real_infection_rate (final)', 'ks')]
+    """
+    seeds = list(seeds)
+    report = EquivalenceReport(alpha)
+    n_ks_tests = len(scenario_codes) * (2 * len(RATE_COLUMNS) + len(COUNT_KEYS))
+    ks_threshold = alpha / n_ks_tests
+    count_populations = {
+        'final_infected': main.configfile.city0_population + main.configfile.city1_population,
+        'final_local_infected': main.configfile.city1_population,
+    }
+
+    for scenario_code in scenario_codes:
+        ref_iters, ref_rates, ref_counts = collect(reference, seeds, scenario_code)
+        cand_iters, cand_rates, cand_counts = collect(candidate, [s + candidate_seed_offset for s in seeds],
+                                                      scenario_code)
+
+        same_iters = len(ref_iters) == len(cand_iters) and np.allclose(ref_iters, cand_iters)
+        report.add_check(scenario_code, 'sample iterations', 'iters', float(len(cand_iters)), float(len(ref_iters)),
+                         same_iters)
+        if not same_iters:
+            continue
+
+        for col in RATE_COLUMNS:
+            _, p = ks_2samp(ref_rates[col].mean(axis=1), cand_rates[col].mean(axis=1))
+            report.add_check(scenario_code, col + ' (mean)', 'ks', p, ks_threshold, p >= ks_threshold)
+            _, p = ks_2samp(ref_rates[col][:, -1], cand_rates[col][:, -1])
+            report.add_check(scenario_code, col + ' (final)', 'ks', p, ks_threshold, p >= ks_threshold)
+            ratio = within_band(ref_rates[col], cand_rates[col], abs_tol, z)
+            report.add_check(scenario_code, col, 'band', ratio, 1.0, ratio <= 1.0)
+
+        for key in COUNT_KEYS:
+            _, p = ks_2samp(ref_counts[key], cand_counts[key])
+            report.add_check(scenario_code, key, 'ks', p, ks_threshold, p >= ks_threshold)
+            ratio = within_band(ref_counts[key][:, None], cand_counts[key][:, None],
+                                abs_tol * count_populations[key], z)
+            report.add_check(scenario_code, key, 'band', ratio, 1.0, ratio <= 1.0)
+
+    return report
+
+
+if __name__ == '__main__':
+    # Sanity check: the reference engine compared with itself (on different seeds) should pass.
+    result = compare_engines(reference_engine)
+    print(result)
+    sys.exit(0 if result.passed else 1)
@@ -6,12 +6,16 @@ Author: Erick Li
 """
 
 import random
+from array import array
 import configfile
+import trajectory
 import pandas as pd
 import plotly.express as px
 
 # the scenario code (check configfile.py)
 SCENARIO_CODE = configfile.scenario_code
+# columns of the dataframe returned by one_round
+COLNAMES = ['iter', 'local_real_infection_rate', 'local_detected_infection_rate', 'local_virus_active_rate']
 
 
 class Person:
@@ -150,6 +154,91 @@ class Person:
         self.curr_y += move_y
 
 
+class ContactBuffer:
+    def __init__(self, pid_list, capacity):
+        """
+        Fixed-capacity ring buffers (one per Person) of the recent close contacts. The buffers are stored in flat arrays
+        so that the memory use does not grow with the number of contacts. When a buffer is full, the least recently seen
+        contact is overwritten.
+        :param pid_list: pids of all the people that may be in the city (including visitors).
+        :param capacity: maximal number of contacts kept for each Person.
+        """
+        if not isinstance(capacity, int):
+            raise TypeError('capacity must be an integer')
+        if capacity <= 0:
+            raise ValueError('capacity must be greater than 0')
+        self.capacity = capacity
+        self.slot = {pid: idx for idx, pid in enumerate(pid_list)}  # pid -> index of the Person's buffer
+        self.contact_pid = array('q', [-1]) * (len(pid_list) * capacity)  # -1: empty
+        self.contact_iter = array('q', [-1]) * (len(pid_list) * capacity)  # iteration when the contact was last seen
+
+    def add_one_way(self, pid, contact_pid, curr_iter):
+        """
+        Record the contact in the Person's buffer. If the contact is already in the buffer, only update the iteration.
+        Otherwise, the contact takes an empty position, or the position of the least recently seen contact.
+        :param pid: the person's ID.
+        :param contact_pid: pid of the close contact.
+        :param curr_iter: current iteration
+        :return:
+        """
+        base = self.slot[pid] * self.capacity
+        recorded = self.contact_pid[base:base + self.capacity]
+        if contact_pid in recorded:
+            self.contact_iter[base + recorded.index(contact_pid)] = curr_iter
+            return
+        # Empty positions have iteration -1, so they are taken first.
+        last_seen = self.contact_iter[base:base + self.capacity]
+        pos = base + last_seen.index(min(last_seen))
+        self.contact_pid[pos] = contact_pid
+        self.contact_iter[pos] = curr_iter
+
+    def add_contact(self, pid1, pid2, curr_iter):
+        """
+        Record a close contact between two people (in both of their buffers).
+        :param pid1: pid of Person 1.
+        :param pid2: pid of Person 2.
+        :param curr_iter: current iteration
+        :return:
+        """
+        self.add_one_way(pid1, pid2, curr_iter)
+        self.add_one_way(pid2, pid1, curr_iter)
+
+    def trace_contacts(self, pid_list, since_iter):
+        """
+        Find the recorded close contacts of the listed people since the given iteration. Only the buffers of the listed
+        people are read.
+        :param pid_list: the list of pids whose contacts are traced.
+        :param since_iter: the earliest iteration of the contacts to be traced.
+        :return: a set of pids of the contacts.
+        >>> buffer = ContactBuffer([1, 2, 3, 4], capacity=2)
+        >>> buffer.add_contact(1, 2, 10)
+        >>> buffer.add_contact(1, 3, 20)
+        >>> buffer.add_contact(1, 4, 30)
+        >>> sorted(buffer.trace_contacts([1], 0))
+        [3, 4]
+        >>> sorted(buffer.trace_contacts([1], 25))
+        [4]
+        >>> sorted(buffer.trace_contacts([2, 3], 0))
+        [1]
+        >>> buffer = ContactBuffer([1, 2, 3, 4], capacity=2)
+        >>> buffer.add_contact(1, 2, 1)
+        >>> buffer.add_contact(1, 3, 2)
+        >>> buffer.add_contact(1, 2, 3)  # Person 2 is seen again
+        >>> buffer.add_contact(1, 4, 4)  # Person 3 is the least recently seen, so it is overwritten
+        >>> sorted(buffer.trace_contacts([1], 3))
+        [2, 4]
+        >>> sorted(buffer.trace_contacts([1], 0))
+        [2, 4]
+        """
+        traced = set()
+        for pid in pid_list:
+            base = self.slot[pid] * self.capacity
+            for pos in range(base, base + self.capacity):
+                if self.contact_pid[pos] != -1 and self.contact_iter[pos] >= since_iter:
+                    traced.add(self.contact_pid[pos])
+        return traced
+
+
 class City:
     def __init__(self, cid, init_population, init_infection_rate, init_masked_rate, max_x, max_y, train_x, train_y):
         """
@@ -178,6 +267,7 @@ class City:
         self.train_x = train_x  # train station limit X
         self.train_y = train_y  # train station limit Y
         self.people_list = []  # list of Person objects currently in the city
+        self.contact_buffer = None  # ContactBuffer of the recent close contacts (only used for contact tracing)
 
         # City A
         if cid == 0:
@@ -334,6 +424,8 @@ class City:
 
                 # If the distance is smaller than 6 units.
                 if distance < 6:
+                    if self.contact_buffer is not None:
+                        self.contact_buffer.add_contact(p1.pid, p2.pid, curr_iter)
                     # If the virus is active in Person 1, but not active in perviously uninfected Person 2, it is
                     #  possible that Person 1 could infect Person 2.
                     if p1.is_virus_active() and not p2.is_virus_active() and not p2.is_infected():
@@ -359,14 +451,17 @@ class City:
         """
         Update the infected people's symptoms based on the symptom period (defined in the configfile.py).
         :param curr_iter: current iteration
-        :return:
+        :return: the list of pids of the people who are detected in the current iteration.
         """
+        newly_detected_pid_list = []
         for idx, p in enumerate(self.people_list):
             # If the Person could show symptoms, got infected, and it has been show_symptom_period iterations since the
             #  infection, the infected Person got detected.
             if p.will_show_symptom and p.infected and curr_iter - p.infected_iter == configfile.show_symptom_period:
                 self.people_list[idx].detected = True
                 self.people_list[idx].detected_iter = curr_iter
+                newly_detected_pid_list.append(p.pid)
+        return newly_detected_pid_list
 
     def update_infection_status(self, curr_iter):
         """
@@ -532,14 +627,18 @@ def get_pid_from_list(li):
     return return_list
 
 
-def one_round(curr_iter, dta):
+def one_round(curr_iter, dta, scenario_code=None, return_cities=False):
     """
     Execute one round of the simulation. Update information of the infection rates.
     :param curr_iter: current iteration
     :param dta: a pandas dataframe. Columns: iteration, local real infection rate, local detected infection rate, and
     local virus active rate.
-    :return: the updated pandas dataframe.
+    :param scenario_code: (optional, default: SCENARIO_CODE) the scenario code (check configfile.py)
+    :param return_cities: (optional, default: False) whether also return the two City objects at the end of the round.
+    :return: the updated pandas dataframe (and City A and City B if return_cities is True).
     """
+    if scenario_code is None:
+        scenario_code = SCENARIO_CODE
     city0 = City(0, configfile.city0_population, configfile.city0_init_infection_rate, configfile.city0_masked_rate,
                  configfile.city_limit_x, configfile.city_limit_y, configfile.station_limit_x,
                  configfile.station_limit_y)
@@ -556,13 +655,24 @@ def one_round(curr_iter, dta):
 
     small_counter = 0
 
+    # Scenario 4: City B keeps the recent close contacts of everyone for contact tracing.
+    if scenario_code == 4:
+        pid_list = get_pid_from_list(city0.people_list) + get_pid_from_list(city1.people_list)
+        city1.contact_buffer = ContactBuffer(pid_list, configfile.contact_buffer_capacity)
+
+    recorder = None
+    if configfile.record_trajectory:
+        pid_list = get_pid_from_list(city0.people_list) + get_pid_from_list(city1.people_list)
+        recorder = trajectory.TrajectoryRecorder(configfile.trajectory_path.format(curr_iter), pid_list,
+                                                 configfile.max_iter, configfile.trajectory_stride)
+
     # The big iteration: each iteration indicates one time unit.
     for iter_idx in range(configfile.max_iter):
         if iter_idx % configfile.trains_departure_iter == 0:
             trainlist = city0.departure()
             city1.arrival(trainlist)
             # Scenario 3: put everyone off the train into quarantine not matter whether they are infected.
-            if SCENARIO_CODE == 3:
+            if scenario_code == 3:
                 trainpid = get_pid_from_list(trainlist)
                 city1.put_into_quarantine_by_pid(iter_idx, trainpid)
 
@@ -587,13 +697,26 @@ def one_round(curr_iter, dta):
         city0.intracity_infection(iter_idx)
         city1.intracity_infection(iter_idx)
         city0.update_symptoms(iter_idx)
-        city1.update_symptoms(iter_idx)
+        newly_detected = city1.update_symptoms(iter_idx)
         city0.update_infection_status(iter_idx)
         city1.update_infection_status(iter_idx)
         # Scenarios 2 & 3: Put anyone who shows symptoms to quarantine.
-        if SCENARIO_CODE == 2 or SCENARIO_CODE == 3:
+        if scenario_code == 2 or scenario_code == 3:
+            city1.put_into_quarantine(iter_idx)
+            city1.update_quarantine_status(iter_idx)
+        # Scenario 4: Put anyone who shows symptoms and their recent close contacts to quarantine.
+        elif scenario_code == 4:
             city1.put_into_quarantine(iter_idx)
+            traced = city1.contact_buffer.trace_contacts(newly_detected,
+                                                         iter_idx - configfile.contact_tracing_period)
+            if len(traced) > 0:
+                city1.put_into_quarantine_by_pid(iter_idx, traced)
             city1.update_quarantine_status(iter_idx)
+        if recorder is not None:
+            recorder.record(iter_idx, [city0, city1])
+
+    if recorder is not None:
+        recorder.close()
 
     if configfile.verbose:
         print(city0.get_curr_real_infection_rate())
@@ -607,12 +730,13 @@ def one_round(curr_iter, dta):
         print(city1.get_curr_population())
         print(dta)
 
+    if return_cities:
+        return dta, city0, city1
     return dta
 
 
 if __name__ == '__main__':
-    colnames = ['iter', 'local_real_infection_rate', 'local_detected_infection_rate', 'local_virus_active_rate']
-    df = pd.DataFrame(columns=colnames)
+    df = pd.DataFrame(columns=COLNAMES)
 
     for roundn in range(configfile.max_round):
         print('Iteration at:', roundn)
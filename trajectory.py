@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+trajectory.py: record where every Person was, and replay / query it afterwards.
+Course: IS 597PRO Fall 2020
+Author: Erick Li
+
+The trajectory of one simulation round is stored in a preallocated, memory-mapped .npy file of shape
+(number of frames, number of people). A frame is written every `stride` iterations. Each cell holds the location of a
+Person, the city the Person is currently in, and the state flags (infected, virus active, ...) packed into one byte.
+A small sidecar file (<path>.meta.npz) keeps the pid of each column and the stride.
+"""
+
+import numpy as np
+
+# Data type of one cell in the trajectory file.
+RECORD_DTYPE = np.dtype([('x', '<f8'), ('y', '<f8'), ('city', 'i1'), ('flags', 'u1')])
+
+# Bits of the packed state flags.
+FLAG_INFECTED = 1
+FLAG_VIRUS_ACTIVE = 2
+FLAG_DETECTED = 4
+FLAG_MASKED = 8
+FLAG_QUARANTINED = 16
+
+
+def pack_flags(p):
+    """
+    Pack the state flags of the Person into one integer (see the FLAG_* constants).
+    :param p: the Person object.
+    :return: the packed flags.
+    >>> from main import Person
+    >>> p = Person(pid=12, infection=True, masked=True, city=0, max_x=100, max_y=100)
+    >>> pack_flags(p) == FLAG_INFECTED | FLAG_VIRUS_ACTIVE | FLAG_MASKED
+    True
+    >>> p.ask_for_quarantine(10)
+    >>> pack_flags(p) & FLAG_QUARANTINED
+    16
+    """
+    return (FLAG_INFECTED * bool(p.infected) |
+            FLAG_VIRUS_ACTIVE * bool(p.virus_active) |
+            FLAG_DETECTED * bool(p.detected) |
+            FLAG_MASKED * bool(p.masked) |
+            FLAG_QUARANTINED * bool(p.under_quarantine))
+
+
+def get_meta_path(path):
+    """
+    Get the path of the sidecar file that stores the pids and the stride of a trajectory file.
+    :param path: path of the trajectory file.
+    :return: path of the sidecar file.
+    >>> get_meta_path('trajectory_round0.npy')
+    'trajectory_round0.npy.meta.npz'
+    """
+    return path + '.meta.npz'
+
+
+class TrajectoryRecorder:
+    def __init__(self, path, pid_list, max_iter, stride):
+        """
+        Preallocate the memory-mapped trajectory file.
+        :param path: path of the trajectory file (.npy).
+        :param pid_list: pids of all the people in the simulation (from both cities).
+        :param max_iter: number of iterations of the round.
+        :param stride: write one frame every `stride` iterations.
+        """
+        if not isinstance(stride, int):
+            raise TypeError('stride must be an integer')
+        if stride <= 0:
+            raise ValueError('stride must be greater than 0')
+        self.path = path
+        self.stride = stride
+        self.pids = np.asarray(pid_list, dtype=np.int64)
+        self.slot = {pid: idx for idx, pid in enumerate(pid_list)}  # pid -> column in the trajectory file
+        self.n_frames = (max_iter + stride - 1) // stride
+        self.frames_written = 0
+        self.frames = np.lib.format.open_memmap(path, mode='w+', dtype=RECORD_DTYPE,
+                                                shape=(self.n_frames, len(self.pids)))
+        # Columns of people who are not found in a frame keep city -1.
+        self.frames['city'] = -1
+        self.write_meta()
+
+    def write_meta(self):
+        """
+        Write the pids, the stride, and the number of frames written so far to the sidecar file.
+        :return:
+        """
+        with open(get_meta_path(self.path), 'wb') as f:
+            np.savez(f, pids=self.pids, stride=self.stride, frames_written=self.frames_written)
+
+    def record(self, curr_iter, city_list):
+        """
+        Write the location, city, and state flags of everyone in the cities if the iteration is a multiple of the
+        stride.
+        :param curr_iter: current iteration
+        :param city_list: list of City objects.
+        :return:
+        """
+        if curr_iter % self.stride != 0:
+            return
+        frame_idx = curr_iter // self.stride
+        if frame_idx >= self.n_frames:
+            return
+        frame = self.frames[frame_idx]
+        for city in city_list:
+            for p in city.people_list:
+                frame[self.slot[p.pid]] = (p.curr_x, p.curr_y, city.cid, pack_flags(p))
+        self.frames_written = frame_idx + 1
+
+    def close(self):
+        """
+        Flush the trajectory file to the disk and update the sidecar file.
+        :return:
+        """
+        self.frames.flush()
+        self.write_meta()
+        del self.frames
+
+
+class Trajectory:
+    def __init__(self, path):
+        """
+        Open a recorded trajectory file read-only. Nothing is loaded until a slice of it is accessed.
+        :param path: path of the trajectory file (.npy).
+        """
+        self.frames = np.load(path, mmap_mode='r')
+        with np.load(get_meta_path(path)) as meta:
+            self.pids = meta['pids']
+            self.stride = int(meta['stride'])
+            self.frames_written = int(meta['frames_written'])
+        self.slot = {int(pid): idx for idx, pid in enumerate(self.pids)}
+
+    def __len__(self):
+        return self.frames_written
+
+    def get_frame_range(self, start_iter, end_iter):
+        """
+        Convert an iteration range into a frame range. Only frames that have been written are included.
+        :param start_iter: first iteration (inclusive).
+        :param end_iter: last iteration (inclusive).
+        :return: a slice of the frame indices.
+        """
+        first = max(0, -(-start_iter // self.stride))
+        last = min(self.frames_written, end_iter // self.stride + 1)
+        return slice(first, max(first, last))
+
+    def get_iters(self, start_iter, end_iter):
+        """
+        Get the iterations of the recorded frames within the range.
+        :param start_iter: first iteration (inclusive).
+        :param end_iter: last iteration (inclusive).
+        :return: an array of iterations.
+        """
+        frame_range = self.get_frame_range(start_iter, end_iter)
+        return np.arange(frame_range.start, frame_range.stop) * self.stride
+
+    def get_path(self, pid, start_iter=0, end_iter=None):
+        """
+        Get the records of one Person within the range. The result is a view of the file (not a copy).
+        :param pid: the person's ID.
+        :param start_iter: (optional, default: 0) first iteration (inclusive).
+        :param end_iter: (optional, default: the last recorded iteration) last iteration (inclusive).
+        :return: an array of records with fields x, y, city, and flags.
+        """
+        if end_iter is None:
+            end_iter = self.frames_written * self.stride
+        return self.frames[self.get_frame_range(start_iter, end_iter), self.slot[pid]]
+
+    def replay(self, start_iter=0, end_iter=None):
+        """
+        Go through the recorded frames one-by-one. Each frame is a view of the file (not a copy).
+        :param start_iter: (optional, default: 0) first iteration (inclusive).
+        :param end_iter: (optional, default: the last recorded iteration) last iteration (inclusive).
+        :return: a generator of (iteration, frame) tuples.
+        """
+        if end_iter is None:
+            end_iter = self.frames_written * self.stride
+        frame_range = self.get_frame_range(start_iter, end_iter)
+        for frame_idx in range(frame_range.start, frame_range.stop):
+            yield frame_idx * self.stride, self.frames[frame_idx]
+
+    def get_close_contacts(self, pid, start_iter, end_iter, distance=6):
+        """
+        Find the people who were within the distance of the Person (in the same city) between the two iterations.
+        Only the frames within the range are read from the file.
+        :param pid: the person's ID.
+        :param start_iter: first iteration (inclusive).
+        :param end_iter: last iteration (inclusive).
+        :param distance: (optional, default: 6) the contact distance.
+        :return: a dictionary. Key: pid of the contact; value: list of iterations when the contact happened.
+        >>> import os, tempfile
+        >>> from types import SimpleNamespace
+        >>> from main import Person
+        >>> people = [Person(pid=pid, infection=False, masked=False, city=0, max_x=100, max_y=100) for pid in range(4)]
+        >>> city_a = SimpleNamespace(cid=0, people_list=people[:3])
+        >>> city_b = SimpleNamespace(cid=1, people_list=people[3:])
+        >>> path = os.path.join(tempfile.mkdtemp(), 'trajectory.npy')
+        >>> recorder = TrajectoryRecorder(path, [0, 1, 2, 3], max_iter=20, stride=5)
+        >>> def move_and_record(curr_iter, locations):
+        ...     for p, (x, y) in zip(people, locations):
+        ...         p.curr_x, p.curr_y = x, y
+        ...     recorder.record(curr_iter, [city_a, city_b])
+        >>> move_and_record(0, [(10, 10), (13, 10), (50, 50), (10, 11)])  # Person 3 is close, but in City B
+        >>> move_and_record(3, [(10, 10), (10, 12), (50, 50), (10, 11)])  # not a multiple of the stride: skipped
+        >>> move_and_record(5, [(10, 10), (50, 50), (10, 15), (10, 11)])
+        >>> move_and_record(10, [(10, 10), (14, 13), (10, 16.5), (10, 11)])
+        >>> recorder.close()
+        >>> traj = Trajectory(path)
+        >>> len(traj), list(traj.get_iters(1, 12))
+        (3, [5, 10])
+        >>> traj.get_close_contacts(0, 0, 4)
+        {1: [0]}
+        >>> sorted(traj.get_close_contacts(0, 1, 12).items())
+        [(1, [10]), (2, [5])]
+        >>> list(traj.get_path(1, 0, 10)['x'])
+        [13.0, 50.0, 14.0]
+        """
+        frame_range = self.get_frame_range(start_iter, end_iter)
+        frames = self.frames[frame_range]
+        target = frames[:, self.slot[pid]]
+
+        dx = frames['x'] - target['x'][:, None]
+        dy = frames['y'] - target['y'][:, None]
+        close = (dx ** 2 + dy ** 2 < distance ** 2) & (frames['city'] == target['city'][:, None])
+        close &= (target['city'] != -1)[:, None]
+        close[:, self.slot[pid]] = False
+
+        contacts = {}
+        for frame_offset, slot in zip(*np.nonzero(close)):
+            contact_pid = int(self.pids[slot])
+            contacts.setdefault(contact_pid, []).append(int((frame_range.start + frame_offset) * self.stride))
+        return contacts